@@ -1,20 +1,33 @@
 import os
 import json
+import orjson
 import asyncio
-from typing import List, Dict, Any
+import hashlib
+import random
+from functools import lru_cache
+from cachetools import LRUCache, TTLCache
+from typing import AsyncIterator, List, Dict, Tuple
 from google.adk import Agent
-from google.adk.tools import AgentTool
 import google.generativeai as genai
+from google.api_core.exceptions import DeadlineExceeded, InternalServerError, ResourceExhausted, ServiceUnavailable
 
 from .models import Article, BiasLabel, ProcessingStatus
-from .tools import fetch_rss_articles, scrape_article_content
-from .database import get_recent_articles, save_article, search_articles_by_query, cleanup_articles
+from .tools import fetch_rss_articles, flatten_feeds, scrape_article_content
+from .concurrency import DynamicLimiter, RateLimiter
 
 # Configure GenAI (ensure API key is set)
 api_key = os.getenv("GEMINI_API_KEY")
 if api_key:
     genai.configure(api_key=api_key)
 
+@lru_cache(maxsize=None)
+def get_model(model_name: str) -> genai.GenerativeModel:
+    """
+    One GenerativeModel per model name, shared by every agent instance.
+    The SDK's gRPC client (and its connections) is already process-wide.
+    """
+    return genai.GenerativeModel(model_name)
+
 class HarvesterAgent(Agent):
     """
     Agent responsible for fetching news articles from RSS feeds.
@@ -28,10 +41,12 @@ class HarvesterAgent(Agent):
         )
         # Store feeds AFTER calling super().__init__ to avoid Pydantic clearing them
         self._feeds = feeds
+        self._feed_jobs = flatten_feeds(feeds)
 
-    def fetch_new_articles(self) -> List[Article]:
-        raw_articles = fetch_rss_articles(self._feeds)
+    async def fetch_new_articles(self) -> List[Article]:
+        raw_articles = await fetch_rss_articles(self._feeds, jobs=self._feed_jobs)
         articles = []
+        expire_at = datetime.utcnow() + timedelta(days=7)
         for data in raw_articles:
             article = Article(
                 url=data["url"],
@@ -43,13 +58,106 @@ class HarvesterAgent(Agent):
                 topic_tags=data["topic_tags"],
                 processing_status=ProcessingStatus.PENDING,
                 created_at=datetime.fromisoformat(data["created_at"]),
-                expire_at=datetime.utcnow() + timedelta(days=7)
+                expire_at=expire_at
             )
             articles.append(article)
         return articles
 
 from datetime import datetime, timedelta
 
+# Number of articles analyzed per Gemini request by the News Chief
+ANALYSIS_BATCH_SIZE = 8
+# Refresh pipeline: concurrent scrapes vs. concurrent Gemini requests
+SCRAPE_CONCURRENCY = 20
+ANALYSIS_CONCURRENCY = 5
+# How long an analysis worker waits for more scraped articles to fill a batch
+BATCH_FILL_TIMEOUT = 0.5
+# Scraped articles are batched by content length, each tier with its own
+# analysis workers, so short articles don't queue behind long ones.
+# (max content chars, workers); None = no upper bound. Workers sum to ANALYSIS_CONCURRENCY.
+LENGTH_TIERS = ((1000, 2), (2500, 2), (None, 1))
+# Gemini quota: requests per minute and prompt tokens per minute (0 = unlimited)
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "20"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "0"))
+# Rough prompt-size estimate used for the token budget
+CHARS_PER_TOKEN = 4
+# Retries for transient Gemini errors
+GENERATE_MAX_ATTEMPTS = 3
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+TRANSIENT_ERRORS = (ResourceExhausted, ServiceUnavailable, InternalServerError, DeadlineExceeded, asyncio.TimeoutError)
+
+ARTICLE_PROMPT = """
+        Analyze this article and provide ONLY valid JSON output (no markdown, no explanations):
+        
+        URL: {url}
+        Headline: {headline}
+        Content: {content}
+        
+        Return JSON with these exact fields:
+        {{
+          "headline": "string",
+          "tldr": "string (max 50 words)",
+          "detailed_summary": "markdown string with sections",
+          "bias_label": "one of: {bias_choices}",
+          "topic_tags": ["tag1", "tag2"],
+          "keywords": ["keyword1", "keyword2"]
+        }}
+        
+        IMPORTANT: Return ONLY the JSON object, nothing else.
+        """
+
+BATCH_PROMPT = """
+        Analyze each of the {count} articles below and provide ONLY valid JSON output (no markdown, no explanations).
+        
+        {sections}
+        
+        Return JSON with one entry per article, using the article number as "index":
+        {{
+          "results": [
+            {{
+              "index": 1,
+              "headline": "string",
+              "tldr": "string (max 50 words)",
+              "detailed_summary": "markdown string with sections",
+              "bias_label": "one of: {bias_choices}",
+              "topic_tags": ["tag1", "tag2"],
+              "keywords": ["keyword1", "keyword2"]
+            }}
+          ]
+        }}
+        
+        IMPORTANT: Return ONLY the JSON object, nothing else.
+        """
+
+# Prompt parts that never change are filled in once at import, so each
+# request only substitutes the article fields
+BIAS_CHOICES = ", ".join(label.value for label in BiasLabel if label != BiasLabel.NOT_AVAILABLE)
+ARTICLE_PROMPT = ARTICLE_PROMPT.replace("{bias_choices}", BIAS_CHOICES)
+BATCH_PROMPT = BATCH_PROMPT.replace("{bias_choices}", BIAS_CHOICES)
+
+# Built once and shared by every analysis request: Gemini returns bare JSON
+# instead of prose or markdown fences
+ANALYSIS_GENERATION_CONFIG = genai.GenerationConfig(response_mime_type="application/json")
+
+def _extract_json(text: str) -> str:
+    """
+    Strips markdown code fences or surrounding prose from a model response.
+    """
+    # Extract JSON from markdown code blocks if present
+    if "```json" in text:
+        text = text.split("```json")[1].split("```")[0].strip()
+    elif "```" in text:
+        text = text.split("```")[1].split("```")[0].strip()
+    
+    # Try to find JSON object boundaries if not in code block
+    if not text.startswith('{'):
+        start = text.find('{')
+        end = text.rfind('}')
+        if start != -1 and end != -1:
+            text = text[start:end+1]
+    return text
+
 class AnalystAgent(Agent):
     """
     Agent responsible for analyzing articles, summarizing them, and detecting bias.
@@ -69,59 +177,84 @@ class AnalystAgent(Agent):
             Output must be valid JSON matching the schema provided in the prompt."""
         )
         # Create a GenerativeModel for direct LLM calls (AFTER super init to avoid Pydantic clearing it)
-        self._model = genai.GenerativeModel('gemini-2.0-flash')
+        self._model = get_model('gemini-2.0-flash')
+        # Cache of parsed Gemini responses keyed by (url, content) hash, kept for 4 hours
+        self._response_cache = TTLCache(maxsize=2048, ttl=4 * 3600)
+        self._cache_stats = {"hit": 0, "miss": 0}
+        # Gemini concurrency: backs off on quota errors (429) and recovers on success
+        self._limiter = DynamicLimiter(ANALYSIS_CONCURRENCY)
+        # Gemini quota pacing: requests and (estimated) prompt tokens per minute
+        self._request_rate = RateLimiter(GEMINI_RPM, 60)
+        self._token_rate = RateLimiter(GEMINI_TPM, 60) if GEMINI_TPM else None
+
+    async def _generate(self, prompt: str) -> str:
+        """
+        Streams a Gemini response through the SDK's native async API
+        and returns the concatenated text.
+        Transient errors (quota, overload, timeouts) are retried with
+        exponential backoff and jitter.
+        """
+        for attempt in range(1, GENERATE_MAX_ATTEMPTS + 1):
+            try:
+                return await self._generate_once(prompt)
+            except TRANSIENT_ERRORS as e:
+                if attempt == GENERATE_MAX_ATTEMPTS:
+                    raise
+                delay = min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)) + random.uniform(0, 1)
+                print(f"Analyst: Gemini call failed ({type(e).__name__}), retrying in {delay:.1f}s", flush=True)
+                await asyncio.sleep(delay)
+
+    async def _generate_once(self, prompt: str) -> str:
+        await self._request_rate.acquire()
+        if self._token_rate:
+            await self._token_rate.acquire(len(prompt) / CHARS_PER_TOKEN)
+        async with self._limiter:
+            try:
+                response = await self._model.generate_content_async(
+                    prompt, generation_config=ANALYSIS_GENERATION_CONFIG, stream=True
+                )
+                text = "".join([chunk.text async for chunk in response if chunk.parts])
+            except ResourceExhausted:
+                await self._limiter.on_throttled()
+                raise
+        await self._limiter.on_success()
+        return text
+
+    @staticmethod
+    def _cache_key(url: str, content: str) -> str:
+        return hashlib.sha256((url + content).encode()).hexdigest()
+
+    @staticmethod
+    def _apply_analysis(article: Article, data: dict):
+        article.headline = data.get("headline", article.headline)
+        article.tldr_summary = data.get("tldr", "")
+        article.detailed_summary = data.get("detailed_summary", "")
+        article.bias_label = BiasLabel(data.get("bias_label", "Center"))
+        article.topic_tags = list(dict.fromkeys(article.topic_tags + data.get("topic_tags", [])))
+        article.keywords = data.get("keywords", [])
+        article.processing_status = ProcessingStatus.PROCESSED
 
     async def process_article(self, article: Article) -> Article:
         # Manually scrape content since we are using direct model calls
-        print(f"Analyst: Scraping {article.url}...", flush=True)
-        full_content = scrape_article_content(article.url, article.summary)
+        content = await self.scrape(article)
+        cache_key = self._cache_key(article.url, content)
         
-        prompt = f"""
-        Analyze this article and provide ONLY valid JSON output (no markdown, no explanations):
-        
-        URL: {article.url}
-        Headline: {article.headline}
-        Content: {full_content[:3000]}
-        
-        Return JSON with these exact fields:
-        {{
-          "headline": "string",
-          "tldr": "string (max 50 words)",
-          "detailed_summary": "markdown string with sections",
-          "bias_label": "one of: Left, Lean Left, Center, Lean Right, Right",
-          "topic_tags": ["tag1", "tag2"],
-          "keywords": ["keyword1", "keyword2"]
-        }}
-        
-        IMPORTANT: Return ONLY the JSON object, nothing else.
-        """
+        prompt = ARTICLE_PROMPT.format(url=article.url, headline=article.headline, content=content)
         
         try:
-            response = self._model.generate_content(prompt)
-            text = response.text if hasattr(response, 'text') else str(response)
-            
-            # Extract JSON from markdown code blocks if present
-            if "```json" in text:
-                text = text.split("```json")[1].split("```")[0].strip()
-            elif "```" in text:
-                text = text.split("```")[1].split("```")[0].strip()
-            
-            # Try to find JSON object boundaries if not in code block
-            if not text.startswith('{'):
-                start = text.find('{')
-                end = text.rfind('}')
-                if start != -1 and end != -1:
-                    text = text[start:end+1]
+            text = self._response_cache.get(cache_key)
+            if text is not None:
+                self._cache_stats["hit"] += 1
+                print(f"Analyst: Cache HIT for {article.url}", flush=True)
+            else:
+                self._cache_stats["miss"] += 1
+                text = await self._generate(prompt)
+                text = _extract_json(text)
                 
-            data = json.loads(text)
-            
-            article.headline = data.get("headline", article.headline)
-            article.tldr_summary = data.get("tldr", "")
-            article.detailed_summary = data.get("detailed_summary", "")
-            article.bias_label = BiasLabel(data.get("bias_label", "Center"))
-            article.topic_tags = list(set(article.topic_tags + data.get("topic_tags", [])))
-            article.keywords = data.get("keywords", [])
-            article.processing_status = ProcessingStatus.PROCESSED
+            data = orjson.loads(text)
+            self._apply_analysis(article, data)
+            # Only cache responses that parsed, so a bad generation is retried next time
+            self._response_cache[cache_key] = text
             print(f"Analyst: Successfully processed {article.url}", flush=True)
             
         except json.JSONDecodeError as e:
@@ -134,6 +267,77 @@ class AnalystAgent(Agent):
             
         return article
 
+    async def scrape(self, article: Article) -> str:
+        """
+        Scrapes the article and returns the content that will be sent to Gemini.
+        """
+        print(f"Analyst: Scraping {article.url}...", flush=True)
+        full_content = await scrape_article_content(article.url, article.summary)
+        return full_content[:3000]
+
+    async def process_articles(self, articles: List[Article]) -> List[Article]:
+        """
+        Analyzes several articles with a single Gemini request.
+        Cached articles skip the request; articles missing from the response are marked FAILED.
+        """
+        if not articles:
+            return articles
+            
+        contents = await asyncio.gather(*[self.scrape(a) for a in articles])
+        return await self.analyze_scraped(list(zip(articles, contents)))
+
+    async def analyze_scraped(self, scraped: List[Tuple[Article, str]]) -> List[Article]:
+        """
+        Same as process_articles, for (article, content) pairs that were already scraped.
+        """
+        articles = [article for article, _ in scraped]
+        
+        # (article, cache_key, content) for every article that needs the LLM
+        pending = []
+        for article, content in scraped:
+            cache_key = self._cache_key(article.url, content)
+            cached = self._response_cache.get(cache_key)
+            if cached is not None:
+                self._cache_stats["hit"] += 1
+                self._apply_analysis(article, orjson.loads(cached))
+            else:
+                pending.append((article, cache_key, content))
+                
+        if not pending:
+            return articles
+        self._cache_stats["miss"] += len(pending)
+        
+        sections = "\n".join(
+            f"### ARTICLE {i}\nURL: {article.url}\nHeadline: {article.headline}\nContent: {content}\n"
+            for i, (article, _, content) in enumerate(pending, start=1)
+        )
+        prompt = BATCH_PROMPT.format(count=len(pending), sections=sections)
+        
+        results_by_index = {}
+        try:
+            text = await self._generate(prompt)
+            for item in orjson.loads(_extract_json(text)).get("results", []):
+                if isinstance(item, dict):
+                    results_by_index[item.get("index")] = item
+        except Exception as e:
+            print(f"Error analyzing batch of {len(pending)} articles: {e}", flush=True)
+            
+        for i, (article, cache_key, _) in enumerate(pending, start=1):
+            data = results_by_index.get(i)
+            if data is None:
+                print(f"Analyst: No result for {article.url}", flush=True)
+                article.processing_status = ProcessingStatus.FAILED
+                continue
+            try:
+                self._apply_analysis(article, data)
+                self._response_cache[cache_key] = orjson.dumps(data)
+                print(f"Analyst: Successfully processed {article.url}", flush=True)
+            except Exception as e:
+                print(f"Error applying analysis for {article.url}: {e}", flush=True)
+                article.processing_status = ProcessingStatus.FAILED
+                
+        return articles
+
 class NewsChiefAgent(Agent):
     """
     Root agent that orchestrates the news gathering and processing.
@@ -149,36 +353,90 @@ class NewsChiefAgent(Agent):
         self._harvester = harvester
         self._analyst = analyst
 
-    async def refresh_news(self) -> Dict[str, int]:
+    async def stream(self) -> AsyncIterator[Article]:
+        """
+        Harvests and analyzes the news, yielding each article as soon as its
+        analysis batch finishes so callers can save while work continues.
+        """
         print("Chief: Starting news refresh cycle...")
-        articles = self._harvester.fetch_new_articles()
+        articles = await self._harvester.fetch_new_articles()
         print(f"Chief: Harvester found {len(articles)} articles.")
         
-        processed_count = 0
-        failed_count = 0
-        sem = asyncio.Semaphore(5)
+        # Two-stage pipeline: scrape workers run ahead and fill the tier queues,
+        # analysis workers drain them in batches so Gemini is never starved.
+        # One queue per length tier
+        scrape_qs = [asyncio.Queue(maxsize=32) for _ in LENGTH_TIERS]
+        results_q = asyncio.Queue()
+        article_iter = iter(articles)
         
-        async def process(art):
-            nonlocal processed_count, failed_count
-            async with sem:
-                res = await self._analyst.process_article(art)
-                # Save article to Firestore
-                await save_article(res)
-                if res.processing_status == ProcessingStatus.PROCESSED:
-                    processed_count += 1
-                else:
-                    failed_count += 1
-                return res
-
-        tasks = [process(a) for a in articles]
-        processed_articles = await asyncio.gather(*tasks)
+        def tier_queue(content: str) -> asyncio.Queue:
+            for (max_chars, _), q in zip(LENGTH_TIERS, scrape_qs):
+                if max_chars is None or len(content) <= max_chars:
+                    return q
         
-        print(f"Chief: Finished processing. Success: {processed_count}, Failed: {failed_count}")
+        async def scrape_worker():
+            # The iterator is shared, so each article is handed out once
+            for art in article_iter:
+                content = await self._analyst.scrape(art)
+                await tier_queue(content).put((art, content))
         
-        # Trigger cleanup to enforce retention policies
-        await cleanup_articles()
+        async def analysis_worker(scrape_q: asyncio.Queue):
+            done = False
+            while not done:
+                item = await scrape_q.get()
+                if item is None:
+                    break
+                batch = [item]
+                while len(batch) < ANALYSIS_BATCH_SIZE:
+                    try:
+                        item = await asyncio.wait_for(scrape_q.get(), timeout=BATCH_FILL_TIMEOUT)
+                    except asyncio.TimeoutError:
+                        break
+                    if item is None:
+                        done = True
+                        break
+                    batch.append(item)
+                    
+                for res in await self._analyst.analyze_scraped(batch):
+                    await results_q.put(res)
+
+        async def run():
+            scrapers = [asyncio.create_task(scrape_worker()) for _ in range(SCRAPE_CONCURRENCY)]
+            analysts = [
+                (q, asyncio.create_task(analysis_worker(q)))
+                for (_, workers), q in zip(LENGTH_TIERS, scrape_qs)
+                for _ in range(workers)
+            ]
+            
+            async def finish_scraping():
+                await asyncio.gather(*scrapers)
+                # One sentinel per analysis worker, on its tier's queue
+                for q, _ in analysts:
+                    await q.put(None)
+            
+            feeder = asyncio.create_task(finish_scraping())
+            tasks = [feeder] + [task for _, task in analysts]
+            try:
+                # Watch the analysis workers too: if a tier's worker fails, its
+                # bounded queue stops draining and the scrapers would block on put
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+            finally:
+                for task in scrapers + tasks:
+                    task.cancel()
+                await results_q.put(None)
         
-        return {"total": len(articles), "processed": processed_count, "failed": failed_count, "articles": processed_articles}
+        runner = asyncio.create_task(run())
+        try:
+            while (article := await results_q.get()) is not None:
+                yield article
+            await runner
+            stats = self._analyst._cache_stats
+            print(f"Chief: Analyst response cache since startup: {stats['hit']} hits, {stats['miss']} misses", flush=True)
+        finally:
+            # Consumer stopped early (or failed): don't leave workers running
+            runner.cancel()
 
 class LibrarianAgent(Agent):
     """
@@ -194,21 +452,30 @@ class LibrarianAgent(Agent):
             Output JSON."""
         )
         # Create a GenerativeModel for direct LLM calls (AFTER super init to avoid Pydantic clearing it)
-        self._model = genai.GenerativeModel('gemini-2.0-flash')
+        self._model = get_model('gemini-2.0-flash')
+        # Translated filters keyed by normalized query text; repeat searches skip Gemini
+        self._query_cache = LRUCache(maxsize=1024)
 
     async def translate_query(self, natural_language_query: str) -> dict:
+        cache_key = " ".join(natural_language_query.lower().split())
+        cached = self._query_cache.get(cache_key)
+        if cached is not None:
+            return cached
+            
         prompt = f"""
         Translate query: "{natural_language_query}"
         Output JSON format: {{ "keywords": [], "topic_tags": [], "bias_label": "" }}
         """
         try:
-            response = self._model.generate_content(prompt)
+            response = await self._model.generate_content_async(prompt)
             text = response.text if hasattr(response, 'text') else str(response)
             if text.startswith("```json"):
                 text = text[7:-3]
             elif text.startswith("```"):
                 text = text[3:-3]
-            return json.loads(text.strip())
+            filters = orjson.loads(text.strip())
+            self._query_cache[cache_key] = filters
+            return filters
         except Exception as e:
             print(f"Error translating query: {e}")
             return {"keywords": [natural_language_query]}
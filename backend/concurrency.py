@@ -0,0 +1,105 @@
+import asyncio
+from typing import Optional
+
+class DynamicLimiter:
+    """
+    Concurrency limiter whose limit can be changed while tasks are waiting.
+    Uses a Condition around an active counter instead of asyncio.Semaphore,
+    whose internal counter can't be resized safely.
+
+    Adapts with AIMD: the limit halves on throttling (on_throttled) and grows
+    by one, up to max_limit, after `increase_after` consecutive successes.
+    """
+    def __init__(self, limit: int, max_limit: Optional[int] = None, increase_after: int = 10):
+        self._limit = limit
+        self._max_limit = max_limit or limit
+        self._increase_after = increase_after
+        self._active = 0
+        self._successes = 0
+        # Created lazily so it binds to the running loop (Python 3.9)
+        self._cond = None
+
+    @property
+    def limit(self) -> int:
+        return self._limit
+
+    def _condition(self) -> asyncio.Condition:
+        if self._cond is None:
+            self._cond = asyncio.Condition()
+        return self._cond
+
+    async def acquire(self):
+        cond = self._condition()
+        async with cond:
+            await cond.wait_for(lambda: self._active < self._limit)
+            self._active += 1
+
+    async def release(self):
+        cond = self._condition()
+        async with cond:
+            self._active -= 1
+            cond.notify(1)
+
+    async def set_limit(self, limit: int):
+        cond = self._condition()
+        async with cond:
+            self._limit = max(1, min(limit, self._max_limit))
+            cond.notify_all()
+
+    async def on_throttled(self):
+        self._successes = 0
+        if self._limit > 1:
+            await self.set_limit(self._limit // 2)
+            print(f"Limiter: throttled, concurrency limit now {self._limit}", flush=True)
+
+    async def on_success(self):
+        self._successes += 1
+        if self._successes >= self._increase_after and self._limit < self._max_limit:
+            self._successes = 0
+            await self.set_limit(self._limit + 1)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        await self.release()
+
+class RateLimiter:
+    """
+    Token bucket: at most `rate` acquisitions per `period` seconds, allowing
+    bursts of up to `rate`. Paces request start times, independent of how
+    many requests are in flight (use a limiter/semaphore for that).
+    """
+    def __init__(self, rate: float, period: float = 1.0):
+        self._capacity = rate
+        self._tokens = float(rate)
+        self._fill_rate = rate / period
+        self._updated = None
+        # Created lazily so it binds to the running loop (Python 3.9)
+        self._lock = None
+
+    async def acquire(self, amount: float = 1):
+        # A single request larger than the bucket waits for a full bucket
+        amount = min(amount, self._capacity)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        # Waiters queue on the lock, so tokens are handed out in arrival order
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            while True:
+                now = loop.time()
+                if self._updated is not None:
+                    self._tokens = min(self._capacity, self._tokens + (now - self._updated) * self._fill_rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                await asyncio.sleep((amount - self._tokens) / self._fill_rate)
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
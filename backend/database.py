@@ -1,86 +1,294 @@
 import os
+import asyncio
+import base64
+import hashlib
+import heapq
+from cachetools import LRUCache
 from google.cloud import firestore
-from datetime import datetime, timedelta
-from typing import List, Optional
+from google.cloud.firestore_v1.base_query import FieldFilter, Or
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+from typing import AsyncIterator, List, Optional, Tuple
+from urllib.parse import urlparse
 from .models import Article
 
-# Initialize Firestore client
-# Note: In a real deployment, credentials would be handled by the environment or default credentials
-try:
-    db = firestore.Client()
-except Exception as e:
-    print(f"Warning: Firestore client could not be initialized: {e}")
-    db = None
-
 COLLECTION_NAME = "articles"
 
+@lru_cache(maxsize=1)
 def get_firestore_client():
-    return db
+    """
+    Returns the process-wide Firestore client, created on first use.
+    Returns None if the client could not be initialized.
+    """
+    # Note: In a real deployment, credentials would be handled by the environment or default credentials
+    try:
+        return firestore.AsyncClient()
+    except Exception as e:
+        print(f"Warning: Firestore client could not be initialized: {e}")
+        return None
+
+@lru_cache(maxsize=1)
+def _coll():
+    """
+    Cached reference to the articles collection.
+    """
+    return get_firestore_client().collection(COLLECTION_NAME)
+
+# One document per day that has articles (doc id = YYYY-MM-DD)
+DATES_COLLECTION_NAME = "article_dates"
+# Dates already materialized by this process
+_known_dates = set()
+
+@lru_cache(maxsize=1)
+def _dates_coll():
+    return get_firestore_client().collection(DATES_COLLECTION_NAME)
+
+# One marker document per completed one-off data migration
+MIGRATIONS_COLLECTION_NAME = "migrations"
+
+def _doc_id(url: str) -> str:
+    """
+    Short deterministic document ID for a URL (the raw URL is kept in the 'url' field).
+    """
+    digest = hashlib.blake2b(url.encode(), digest_size=12).digest()
+    return base64.urlsafe_b64encode(digest).decode().rstrip("=")
+
+# url -> fingerprint of the payload last written for it. Re-saving an article
+# whose content hasn't changed (re-harvests, repeated failures) is skipped.
+_written = LRUCache(maxsize=50_000)
+
+def _fingerprint(data: dict) -> str:
+    """
+    Stable hash of an article payload. Datetimes are normalized to naive UTC
+    so documents read back from Firestore match freshly built ones.
+    """
+    normalized = []
+    for key in sorted(data):
+        value = data[key]
+        if isinstance(value, datetime):
+            if value.tzinfo:
+                value = value.astimezone(timezone.utc).replace(tzinfo=None)
+            value = value.isoformat()
+        normalized.append((key, value))
+    return hashlib.blake2b(repr(normalized).encode(), digest_size=16).hexdigest()
+
+def _to_doc(article: Article) -> dict:
+    # Unset optional fields (None) are left out of the stored document.
+    # Datetimes stay native so Firestore range queries on created_at keep working.
+    return article.model_dump(exclude_none=True)
+
+# Firestore allows at most 500 writes per batch
+WRITE_BATCH_SIZE = 500
+# Max batch commits in flight at once
+WRITE_CONCURRENCY = 20
 
-async def save_article(article: Article):
+async def save_articles_bulk(articles: List[Article]):
+    """
+    Saves many articles with batched writes: one commit per WRITE_BATCH_SIZE
+    documents instead of one round-trip per article.
+    """
+    db = get_firestore_client()
     if not db:
         print("Firestore DB not initialized")
         return
+        
+    # Only write articles whose content changed since they were last saved
+    changed = []
+    for article in articles:
+        data = _to_doc(article)
+        fingerprint = _fingerprint(data)
+        if _written.get(article.url) != fingerprint:
+            changed.append((article.url, data, fingerprint))
+            
+    sem = asyncio.Semaphore(WRITE_CONCURRENCY)
     
-    doc_ref = db.collection(COLLECTION_NAME).document(article.url.replace("/", "_")) # Simple encoding for ID
-    doc_ref.set(article.dict())
+    async def commit_chunk(chunk):
+        async with sem:
+            batch = db.batch()
+            for url, data, _ in chunk:
+                batch.set(_coll().document(_doc_id(url)), data)
+            await batch.commit()
+            for url, _, fingerprint in chunk:
+                _written[url] = fingerprint
+                
+    # Commit the chunks concurrently (bounded) rather than one after another
+    await asyncio.gather(*(
+        commit_chunk(changed[start:start + WRITE_BATCH_SIZE])
+        for start in range(0, len(changed), WRITE_BATCH_SIZE)
+    ))
+            
+    await _materialize_dates({article.created_at.date().isoformat() for article in articles})
 
-async def get_recent_articles(limit: int = 50, filter_date: datetime.date = None):
+async def warm_write_cache(limit: int = 500):
     """
-    Retrieves the most recent articles from Firestore.
-    If filter_date is provided, filters by that specific date (UTC).
+    Seeds the written-fingerprint cache with the most recent stored articles,
+    so the first refresh after startup doesn't rewrite unchanged documents.
     """
-    if not db:
-        return []
+    if not get_firestore_client():
+        return
         
     try:
-        articles_ref = db.collection(COLLECTION_NAME)
+        docs = _coll()\
+                 .order_by("created_at", direction=firestore.Query.DESCENDING)\
+                 .limit(limit)\
+                 .stream()
+        async for doc in docs:
+            data = doc.to_dict()
+            # Legacy-ID documents are left out (they are moved by the migration)
+            if doc.id != _doc_id(data.get("url", "")):
+                continue
+            try:
+                article = Article(**data)
+            except Exception:
+                continue
+            _written[article.url] = _fingerprint(_to_doc(article))
+    except Exception as e:
+        print(f"Error warming write cache: {e}")
+
+async def migrate_legacy_doc_ids():
+    """
+    One-off migration: moves articles stored under the legacy URL-based
+    document ID to their hashed ID. Guarded by a marker document, so it
+    only scans the articles once.
+    """
+    db = get_firestore_client()
+    if not db:
+        return
         
-        if filter_date:
-            # Create start and end of the day timestamps
-            start_of_day = datetime.combine(filter_date, datetime.min.time())
-            end_of_day = datetime.combine(filter_date, datetime.max.time())
+    try:
+        marker = db.collection(MIGRATIONS_COLLECTION_NAME).document("legacy_doc_ids")
+        if (await marker.get()).exists:
+            return
             
-            query = articles_ref.where(
-                "created_at", ">=", start_of_day
-            ).where(
-                "created_at", "<=", end_of_day
-            ).order_by(
-                "created_at", direction=firestore.Query.DESCENDING
-            )
-        else:
-            query = articles_ref.order_by(
-                "created_at", direction=firestore.Query.DESCENDING
-            )
+        print("Migrating legacy article document IDs...", flush=True)
+        legacy = []
+        async for doc in _coll().stream():
+            data = doc.to_dict()
+            url = data.get("url")
+            if url and doc.id != _doc_id(url):
+                legacy.append((doc.id, url, data))
+                
+        # An article re-saved under its new ID since keeps that (newer) copy
+        new_refs = [_coll().document(_doc_id(url)) for _, url, _ in legacy]
+        existing = {doc.id async for doc in db.get_all(new_refs) if doc.exists} if new_refs else set()
+        
+        # Up to two writes per article: the set and the delete
+        for start in range(0, len(legacy), WRITE_BATCH_SIZE // 2):
+            batch = db.batch()
+            for doc_id, url, data in legacy[start:start + WRITE_BATCH_SIZE // 2]:
+                if _doc_id(url) not in existing:
+                    batch.set(_coll().document(_doc_id(url)), data)
+                batch.delete(_coll().document(doc_id))
+            await batch.commit()
             
-        docs = query.limit(limit).stream()
-        return [doc.to_dict() for doc in docs]
+        await marker.set({"completed_at": datetime.utcnow(), "migrated": len(legacy)})
+        print(f"Migrated {len(legacy)} legacy article documents.", flush=True)
+    except Exception as e:
+        print(f"Error migrating legacy document IDs: {e}", flush=True)
+
+async def get_recent_urls(hours: int = 48) -> List[str]:
+    """
+    URLs of articles created in the last `hours` hours (url field only).
+    """
+    if not get_firestore_client():
+        return []
+        
+    try:
+        cutoff = datetime.utcnow() - timedelta(hours=hours)
+        docs = _coll()\
+                 .where(filter=FieldFilter("created_at", ">=", cutoff))\
+                 .select(["url"])\
+                 .stream()
+        return [url async for doc in docs if (url := doc.to_dict().get("url"))]
+    except Exception as e:
+        print(f"Error retrieving recent urls: {e}")
+        return []
+
+async def iter_recent_articles(limit: int = 50, filter_date: datetime.date = None) -> AsyncIterator[dict]:
+    """
+    Yields the most recent articles from Firestore as they stream in.
+    If filter_date is provided, filters by that specific date (UTC).
+    Errors propagate to the caller.
+    """
+    if not get_firestore_client():
+        return
+        
+    articles_ref = _coll()
+    
+    if filter_date:
+        # Create start and end of the day timestamps
+        start_of_day = datetime.combine(filter_date, datetime.min.time())
+        end_of_day = datetime.combine(filter_date, datetime.max.time())
+        
+        query = articles_ref.where(
+            filter=FieldFilter("created_at", ">=", start_of_day)
+        ).where(
+            filter=FieldFilter("created_at", "<=", end_of_day)
+        ).order_by(
+            "created_at", direction=firestore.Query.DESCENDING
+        )
+    else:
+        query = articles_ref.order_by(
+            "created_at", direction=firestore.Query.DESCENDING
+        )
+        
+    async for doc in query.limit(limit).stream():
+        yield doc.to_dict()
+
+async def get_recent_articles(limit: int = 50, filter_date: datetime.date = None):
+    """
+    Retrieves the most recent articles from Firestore.
+    If filter_date is provided, filters by that specific date (UTC).
+    """
+    try:
+        return [data async for data in iter_recent_articles(limit=limit, filter_date=filter_date)]
     except Exception as e:
         print(f"Error retrieving articles: {e}")
         return []
 
-async def get_pending_articles(limit: int = 10, statuses: List[str] = None) -> List[dict]:
+async def get_pending_articles(limit: int = 10, statuses: List[str] = None,
+                               start_after: Optional[firestore.DocumentSnapshot] = None
+                               ) -> Tuple[List[firestore.DocumentSnapshot], Optional[firestore.DocumentSnapshot]]:
     """
     Retrieves articles with specified processing statuses.
     Default is ['pending'].
+    Pages with a cursor: pass the returned last snapshot as `start_after` to
+    continue after the previous page instead of re-scanning from the start.
+    Returns (snapshots, last snapshot or None).
     """
-    if not db:
-        return []
+    if not get_firestore_client():
+        return [], None
     
     if statuses is None:
         statuses = ["pending"]
     
     try:
         # Use 'in' operator for multiple statuses
-        docs = db.collection(COLLECTION_NAME)\
-                 .where("processing_status", "in", statuses)\
-                 .limit(limit)\
-                 .stream()
+        query = _coll()\
+                 .where(filter=FieldFilter("processing_status", "in", statuses))\
+                 .order_by("__name__")
+        if start_after is not None:
+            query = query.start_after(start_after)
         
-        return [doc.to_dict() for doc in docs]
+        docs = [doc async for doc in query.limit(limit).stream()]
+        return docs, (docs[-1] if docs else None)
     except Exception as e:
         print(f"Error retrieving pending articles: {e}")
-        return []
+        return [], None
+
+async def iter_pending_pages(statuses: List[str] = None, page_size: int = 100) -> AsyncIterator[List[dict]]:
+    """
+    Yields every article with the given processing statuses as pages of
+    records, fetching one cursor page at a time so the full result set is
+    never held in memory.
+    """
+    last_doc = None
+    while True:
+        docs, last_doc = await get_pending_articles(limit=page_size, statuses=statuses, start_after=last_doc)
+        if docs:
+            yield [doc.to_dict() for doc in docs]
+        if len(docs) < page_size:
+            return
 
 async def get_backfill_candidates(limit: int = 50) -> List[dict]:
     """
@@ -89,35 +297,40 @@ async def get_backfill_candidates(limit: int = 50) -> List[dict]:
     1. Articles with processing_status='pending'
     2. Articles where detailed_summary is missing or empty (legacy data)
     """
-    if not db:
+    if not get_firestore_client():
         return []
         
     candidates = []
     try:
         # 1. Fetch pending
-        pending_docs = db.collection(COLLECTION_NAME)\
-                 .where("processing_status", "==", "pending")\
+        pending_docs = _coll()\
+                 .where(filter=FieldFilter("processing_status", "==", "pending"))\
                  .limit(limit)\
                  .stream()
         
-        for doc in pending_docs:
+        async for doc in pending_docs:
             candidates.append(doc.to_dict())
             
         if len(candidates) >= limit:
             return candidates
+            
+        seen = {c['url'] for c in candidates}
 
         # 2. Fetch missing summaries (legacy)
         # Note: Firestore doesn't support "where field is null" or "where field is empty string" easily combined with other filters
         # We'll fetch recent articles and filter in memory for this backfill task
-        recent_docs = db.collection(COLLECTION_NAME)\
+        # Only the fields needed to decide candidacy; full docs are fetched afterwards
+        recent_docs = _coll()\
                  .order_by("created_at", direction=firestore.Query.DESCENDING)\
+                 .select(["url", "processing_status", "detailed_summary", "keywords"])\
                  .limit(100)\
                  .stream()
-                 
-        for doc in recent_docs:
+        
+        selected_refs = []
+        async for doc in recent_docs:
             data = doc.to_dict()
             # Check if it's already in candidates
-            if any(c['url'] == data['url'] for c in candidates):
+            if data.get('url') in seen:
                 continue
                 
             # Check if it needs processing
@@ -139,66 +352,104 @@ async def get_backfill_candidates(limit: int = 50) -> List[dict]:
                 needs_update = True
                 
             if needs_update:
-                candidates.append(data)
-                if len(candidates) >= limit:
+                selected_refs.append(doc.reference)
+                seen.add(data.get('url'))
+                if len(candidates) + len(selected_refs) >= limit:
                     break
+        
+        if selected_refs:
+            full_docs = {}
+            async for snap in get_firestore_client().get_all(selected_refs):
+                if snap.exists:
+                    full_docs[snap.id] = snap.to_dict()
+            # get_all doesn't guarantee order; keep newest-first
+            candidates.extend(full_docs[ref.id] for ref in selected_refs if ref.id in full_docs)
                     
         return candidates
     except Exception as e:
         print(f"Error retrieving backfill candidates: {e}")
         return []
 
+async def _materialize_dates(dates: set):
+    """
+    Records article dates in the DATES_COLLECTION (one doc per YYYY-MM-DD),
+    skipping dates already written by this process.
+    """
+    new_dates = dates - _known_dates
+    if not new_dates:
+        return
+    batch = get_firestore_client().batch()
+    for date_iso in new_dates:
+        batch.set(_dates_coll().document(date_iso), {"date": date_iso}, merge=True)
+    await batch.commit()
+    _known_dates.update(new_dates)
+
 async def get_available_dates() -> List[str]:
     """
     Retrieves a list of unique dates (YYYY-MM-DD) from stored articles.
-    Note: Firestore doesn't support 'SELECT DISTINCT' natively efficiently.
-    For high volume, we'd aggregate this in a separate collection.
-    For this MVP, we'll fetch recent article dates.
+    Firestore doesn't support 'SELECT DISTINCT', so dates are materialized
+    into their own collection on save and read back with a single small query.
     """
-    if not db:
+    if not get_firestore_client():
         return []
         
     try:
-        # Optimization: Just fetch the 'created_at' field for the last 500 articles
-        # and extract unique dates.
-        docs = db.collection(COLLECTION_NAME)\
-                 .order_by("created_at", direction=firestore.Query.DESCENDING)\
-                 .limit(500)\
-                 .select(["created_at"])\
-                 .stream()
-        
-        dates = set()
-        for doc in docs:
-            data = doc.to_dict()
-            if "created_at" in data:
-                # Handle both datetime object and string (if serialized)
-                created_at = data["created_at"]
-                if hasattr(created_at, "date"):
-                    dates.add(created_at.date().isoformat())
-                elif isinstance(created_at, str):
-                     dates.add(created_at[:10])
-        
-        return sorted(list(dates), reverse=True)
+        dates = [doc.id async for doc in _dates_coll().stream()]
+        return sorted(dates, reverse=True)
     except Exception as e:
         print(f"Error retrieving available dates: {e}")
         return []
 
+async def backfill_article_dates():
+    """
+    One-off migration: records the date of every stored article in the
+    DATES_COLLECTION, so dates of articles saved before dates were
+    materialized show up too. Guarded by a marker document, so it only
+    scans the articles once.
+    """
+    db = get_firestore_client()
+    if not db:
+        return
+        
+    try:
+        marker = db.collection(MIGRATIONS_COLLECTION_NAME).document("article_dates_backfill")
+        if (await marker.get()).exists:
+            return
+            
+        print("Backfilling article dates...", flush=True)
+        dates = set()
+        async for doc in _coll().select(["created_at"]).stream():
+            created_at = doc.to_dict().get("created_at")
+            # Handle both datetime object and string (if serialized)
+            if hasattr(created_at, "date"):
+                dates.add(created_at.date().isoformat())
+            elif isinstance(created_at, str):
+                dates.add(created_at[:10])
+                
+        if dates:
+            await _materialize_dates(dates)
+        await marker.set({"completed_at": datetime.utcnow(), "dates": len(dates)})
+        print(f"Backfilled {len(dates)} article dates.", flush=True)
+    except Exception as e:
+        print(f"Error backfilling article dates: {e}", flush=True)
+
 async def search_articles_by_query(query_params: dict) -> List[dict]:
     """
     Executes a constructed query against Firestore.
     """
-    if not db:
+    if not get_firestore_client():
         return []
     
-    ref = db.collection(COLLECTION_NAME)
+    ref = _coll()
     
-    # Apply filters
+    # Apply filters in ESR order (Equality -> Sort -> Range) so the query is
+    # served by the composite indexes in firestore.indexes.json
     if query_params.get("bias_label"):
-        ref = ref.where("bias_label", "==", query_params["bias_label"])
+        ref = ref.where(filter=FieldFilter("bias_label", "==", query_params["bias_label"]))
         
     if query_params.get("topic_tags"):
         # Firestore allows 'array_contains_any' for list fields
-        ref = ref.where("topic_tags", "array_contains_any", query_params["topic_tags"])
+        ref = ref.where(filter=FieldFilter("topic_tags", "array_contains_any", query_params["topic_tags"]))
         
     # Note: Firestore has limitations on compound queries. 
     # For this MVP, we'll prioritize topic tags and bias.
@@ -206,25 +457,38 @@ async def search_articles_by_query(query_params: dict) -> List[dict]:
     
     docs = ref.order_by("created_at", direction=firestore.Query.DESCENDING).limit(20).stream()
     
-    return [doc.to_dict() for doc in docs]
+    return [doc.to_dict() async for doc in docs]
+
+@lru_cache(maxsize=4096)
+def _domain(url: str) -> str:
+    """
+    Host of a URL without a leading 'www.' ('' if the URL can't be parsed).
+    """
+    try:
+        return urlparse(url).netloc.removeprefix("www.")
+    except ValueError:
+        return ""
 
 async def find_similar_articles(article_id: str, limit: int = 5) -> List[dict]:
     """
     Finds similar articles based on topic tags.
     Prioritizes articles with different bias labels to show diverse perspectives.
     """
-    if not db:
+    if not get_firestore_client():
         return []
         
     try:
         # 1. Get the target article
-        # article_id is the URL (encoded or raw? The frontend passes the full URL usually)
-        # In save_article we use url.replace("/", "_") as ID. 
-        # Let's try to find it by ID first, if not, query by URL.
+        # article_id is the URL passed by the frontend; the doc ID is derived
+        # from it, so try a direct lookup first.
+        target_doc = await _coll().document(_doc_id(article_id)).get()
         
-        # Assuming article_id passed from frontend is the actual URL
-        target_ref = db.collection(COLLECTION_NAME).where("url", "==", article_id).limit(1).stream()
-        target_doc = next(target_ref, None)
+        if not target_doc.exists:
+            # Documents saved under the legacy ID scheme
+            target_ref = _coll().where(filter=FieldFilter("url", "==", article_id)).limit(1).stream()
+            target_doc = None
+            async for doc in target_ref:
+                target_doc = doc
         
         if not target_doc:
             print(f"Target article not found: {article_id}")
@@ -234,78 +498,57 @@ async def find_similar_articles(article_id: str, limit: int = 5) -> List[dict]:
         target_tags = target_data.get("topic_tags", [])
         target_keywords = target_data.get("keywords", [])
         target_bias = target_data.get("bias_label", "Center")
-        target_domain = ""
-        try:
-            from urllib.parse import urlparse
-            target_domain = urlparse(target_data["url"]).netloc.replace("www.", "")
-        except:
-            pass
+        target_domain = _domain(target_data.get("url", ""))
         
         if not target_tags and not target_keywords:
             return []
             
-        # 2. Query for articles with matching keywords OR tags
-        # Firestore limitation: can't do OR across different fields easily or multiple array-contains
-        # We'll prioritize keywords if available, otherwise tags
+        # 2. Query for articles with matching keywords OR tags in a single query
+        filters = []
+        if target_keywords:
+            filters.append(FieldFilter("keywords", "array_contains_any", target_keywords[:10]))
+        if target_tags:
+            filters.append(FieldFilter("topic_tags", "array_contains_any", target_tags[:10]))
+        query_filter = filters[0] if len(filters) == 1 else Or(filters)
         
         candidates = []
         seen_urls = set()
         seen_urls.add(target_data["url"])
         
-        # Helper to process results
-        def process_results(docs):
-            for doc in docs:
-                data = doc.to_dict()
-                url = data.get("url", "")
-                if url in seen_urls:
-                    continue
-                    
-                # Strict Domain Filter
-                try:
-                    domain = urlparse(url).netloc.replace("www.", "")
-                    if domain == target_domain:
-                        continue
-                except:
-                    pass
-                    
-                candidates.append(data)
-                seen_urls.add(url)
-
-        # Query by keywords first (more specific)
-        if target_keywords:
-            keyword_docs = db.collection(COLLECTION_NAME)\
-                             .where("keywords", "array_contains_any", target_keywords[:10])\
-                             .limit(20)\
-                             .stream()
-            process_results(keyword_docs)
-            
-        # If not enough, query by tags
-        if len(candidates) < limit and target_tags:
-            tag_docs = db.collection(COLLECTION_NAME)\
-                         .where("topic_tags", "array_contains_any", target_tags)\
-                         .limit(20)\
-                         .stream()
-            process_results(tag_docs)
+        docs = _coll().where(filter=query_filter).limit(40).stream()
+        async for doc in docs:
+            data = doc.to_dict()
+            url = data.get("url", "")
+            if url in seen_urls:
+                continue
+                
+            # Strict Domain Filter
+            if _domain(url) == target_domain:
+                continue
+                
+            candidates.append(data)
+            seen_urls.add(url)
             
         # 3. Sort/Filter for diversity
         # We want to show articles that match tags but have DIFFERENT bias if possible.
         
+        target_keywords_set = set(target_keywords)
+        target_tags_set = set(target_tags)
+        
         def diversity_score(article):
             score = 0
             # Higher score if bias is different
             if article.get("bias_label") != target_bias:
                 score += 10
             # Keyword match boost
-            common_keywords = set(article.get("keywords", [])) & set(target_keywords)
+            common_keywords = target_keywords_set.intersection(article.get("keywords", []))
             score += len(common_keywords) * 5
             # Tag match boost
-            common_tags = set(article.get("topic_tags", [])) & set(target_tags)
+            common_tags = target_tags_set.intersection(article.get("topic_tags", []))
             score += len(common_tags)
             return score
             
-        candidates.sort(key=diversity_score, reverse=True)
-        
-        return candidates[:limit]
+        return heapq.nlargest(limit, candidates, key=diversity_score)
         
     except Exception as e:
         print(f"Error finding similar articles: {e}")
@@ -318,6 +561,7 @@ async def cleanup_articles():
     2. Max 100 articles total (keep newest)
     3. Max 20 articles per day (keep newest for that day)
     """
+    db = get_firestore_client()
     if not db:
         return
 
@@ -327,9 +571,9 @@ async def cleanup_articles():
         # 1. Fetch all articles (metadata only to save bandwidth if possible, but we need dates)
         # Firestore doesn't support "select keys only" easily without cost.
         # We'll fetch all and process in memory for this scale (100-200 docs is fine).
-        docs = db.collection(COLLECTION_NAME).stream()
+        docs = _coll().stream()
         all_articles = []
-        for doc in docs:
+        async for doc in docs:
             data = doc.to_dict()
             data['id'] = doc.id
             # Ensure created_at is datetime
@@ -406,17 +650,31 @@ async def cleanup_articles():
             batch = db.batch()
             count = 0
             for doc_id in articles_to_delete:
-                ref = db.collection(COLLECTION_NAME).document(doc_id)
+                ref = _coll().document(doc_id)
                 batch.delete(ref)
                 count += 1
                 if count >= 400: # Firestore batch limit is 500
-                    batch.commit()
+                    await batch.commit()
                     batch = db.batch()
                     count = 0
             
             if count > 0:
-                batch.commit()
+                await batch.commit()
+                
+            # Deleted documents must be written again if they are re-harvested
+            for art in all_articles:
+                if art['id'] in articles_to_delete:
+                    _written.pop(art.get('url'), None)
             print("Cleanup complete.", flush=True)
+            
+            # Drop materialized dates that no longer have any articles
+            stale_dates = [doc.id async for doc in _dates_coll().stream() if doc.id not in articles_by_day]
+            if stale_dates:
+                batch = db.batch()
+                for date_iso in stale_dates:
+                    batch.delete(_dates_coll().document(date_iso))
+                await batch.commit()
+                _known_dates.difference_update(stale_dates)
         else:
             print("No articles to delete.", flush=True)
 
@@ -3,11 +3,6 @@ import feedparser
 from typing import List
 from .models import Article, BiasLabel, ProcessingStatus
 from datetime import datetime, timedelta
-import ssl
-
-# Bypass SSL verification for local dev issues
-if hasattr(ssl, '_create_unverified_context'):
-    ssl._create_default_https_context = ssl._create_unverified_context
 
 class HarvesterAgent:
     def __init__(self, feeds: dict):
@@ -83,10 +78,46 @@ class HarvesterAgent:
 
 import google.generativeai as genai
 import os
-import json
+import orjson
+import re
 import requests
 from bs4 import BeautifulSoup
 
+# Blocking phrases common in paywalls/anti-bot pages
+BLOCKING_PHRASES = [
+    "enable javascript",
+    "disable ad blocker",
+    "turn off your ad blocker",
+    "subscribe to read",
+    "subscription required",
+    "sign in to continue",
+    "you have reached your limit",
+    "access to this content is restricted",
+    "please enable cookies"
+]
+_BLOCK_RE = re.compile("|".join(map(re.escape, BLOCKING_PHRASES)), re.IGNORECASE)
+
+ANALYSIS_PROMPT = """
+        Analyze the following news article text and provide a structured summary.
+        
+        Context:
+        - Source Domain: {domain}
+        - Typical Source Bias: {bias} (Use this as a baseline, but evaluate the specific text. If the text is neutral despite the source, label it 'Center'. If it reflects the source's bias, label it accordingly.)
+        
+        Article Text:
+        {text}
+        
+        Output must be valid JSON with the following fields:
+        - "headline": A catchy, neutral headline (or keep original if good).
+        - "tldr": A 2-3 sentence quick summary (max 50 words).
+        - "detailed_summary": A structured summary with 3 sections: "What Happened", "Impact/Reactions", and "Conclusion". Total length should be 150-200 words. Use Markdown formatting for the sections (e.g. **What Happened**: ...).
+        - "bias_label": One of "Left", "Lean Left", "Center", "Lean Right", "Right".
+        - "topic_tags": A list of 3-5 relevant tags.
+        - "keywords": A list of 3-5 specific entities (people, places, organizations) mentioned.
+        
+        JSON Output:
+        """
+
 class AnalystAgent:
     def __init__(self, api_key: str):
         self.api_key = api_key
@@ -96,6 +127,26 @@ class AnalystAgent:
         else:
             self.model = None
             print("Warning: Gemini API Key not provided.")
+        self.bias_map = self._load_bias_map()
+        # Longest keys first so the most specific partial match wins (e.g. edition.cnn.com -> cnn.com)
+        self._bias_substring_items = sorted(self.bias_map.items(), key=lambda kv: -len(kv[0]))
+
+    @staticmethod
+    def _load_bias_map() -> dict:
+        """
+        Loads known_bias.json (domain -> bias label) from this package directory.
+        """
+        import pathlib
+        bias_file = pathlib.Path(__file__).parent.absolute() / "known_bias.json"
+        if not bias_file.exists():
+            print(f"Warning: Bias file not found at {bias_file}")
+            return {}
+        try:
+            with open(bias_file, "rb") as f:
+                return orjson.loads(f.read())
+        except Exception as e:
+            print(f"Error loading known bias: {e}")
+            return {}
 
 
     async def process_article(self, article: Article) -> Article:
@@ -121,19 +172,6 @@ class AnalystAgent:
         
         # Let's try to fetch the URL content simply
         
-        # Blocking phrases common in paywalls/anti-bot pages
-        BLOCKING_PHRASES = [
-            "enable javascript",
-            "disable ad blocker",
-            "turn off your ad blocker",
-            "subscribe to read",
-            "subscription required",
-            "sign in to continue",
-            "you have reached your limit",
-            "access to this content is restricted",
-            "please enable cookies"
-        ]
-
         text = ""
         try:
             # Simple fetch (blocking, should be async or in thread)
@@ -141,7 +179,7 @@ class AnalystAgent:
             def fetch_text():
                 try:
                     resp = requests.get(article.url, timeout=5, headers={"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"})
-                    soup = BeautifulSoup(resp.content, 'html.parser')
+                    soup = BeautifulSoup(resp.content, 'lxml')
                     
                     # Remove script and style elements
                     for script in soup(["script", "style", "nav", "footer", "header"]):
@@ -155,16 +193,8 @@ class AnalystAgent:
             
             text = await loop.run_in_executor(None, fetch_text)
             
-            # Check for blocking content
-            text_lower = text.lower()
-            is_blocked = False
-            if len(text) < 200: # Too short, likely failed or just a blurb
-                is_blocked = True
-            else:
-                for phrase in BLOCKING_PHRASES:
-                    if phrase in text_lower:
-                        is_blocked = True
-                        break
+            # Check for blocking content (too short is likely a failed fetch or just a blurb)
+            is_blocked = len(text) < 200 or bool(_BLOCK_RE.search(text))
             
             if is_blocked:
                 print(f"Content blocked or too short for {article.url}. Using RSS summary fallback.")
@@ -177,63 +207,21 @@ class AnalystAgent:
         if not text or len(text) < 50:
             text = f"{article.headline}. {article.summary}" # Fallback to headline + summary
             
-        # Load known bias
-        known_bias_label = "Unknown"
-        try:
-            from urllib.parse import urlparse
-            domain = urlparse(article.url).netloc.replace("www.", "")
-            
-            # Load bias map (cache this in production)
-            import pathlib
-            # Get the directory where this file (agents.py) is located
-            current_dir = pathlib.Path(__file__).parent.absolute()
-            bias_file = current_dir / "known_bias.json"
-            
-            if bias_file.exists():
-                with open(bias_file, "r") as f:
-                    bias_map = json.load(f)
-                    
-                # Check for exact match or substring match
-                if domain in bias_map:
-                    known_bias_label = bias_map[domain]
-                else:
-                    # Try to find partial match (e.g. edition.cnn.com -> cnn.com)
-                    for key, val in bias_map.items():
-                        if key in domain:
-                            known_bias_label = val
-                            break
-            else:
-                print(f"Warning: Bias file not found at {bias_file}")
-        except Exception as e:
-            print(f"Error loading known bias: {e}")
+        # Look up known bias (map is loaded once in __init__)
+        from urllib.parse import urlparse
+        domain = urlparse(article.url).netloc.removeprefix("www.")
+        known_bias_label = self.bias_map.get(domain) or next(
+            (val for key, val in self._bias_substring_items if key in domain),
+            "Unknown"
+        )
 
-        prompt = f"""
-        Analyze the following news article text and provide a structured summary.
-        
-        Context:
-        - Source Domain: {domain}
-        - Typical Source Bias: {known_bias_label} (Use this as a baseline, but evaluate the specific text. If the text is neutral despite the source, label it 'Center'. If it reflects the source's bias, label it accordingly.)
-        
-        Article Text:
-        {text[:4000]}
-        
-        Output must be valid JSON with the following fields:
-        - "headline": A catchy, neutral headline (or keep original if good).
-        - "tldr": A 2-3 sentence quick summary (max 50 words).
-        - "detailed_summary": A structured summary with 3 sections: "What Happened", "Impact/Reactions", and "Conclusion". Total length should be 150-200 words. Use Markdown formatting for the sections (e.g. **What Happened**: ...).
-        - "bias_label": One of "Left", "Lean Left", "Center", "Lean Right", "Right".
-        - "bias_label": One of "Left", "Lean Left", "Center", "Lean Right", "Right".
-        - "topic_tags": A list of 3-5 relevant tags.
-        - "keywords": A list of 3-5 specific entities (people, places, organizations) mentioned.
-        
-        JSON Output:
-        """
+        prompt = ANALYSIS_PROMPT.format(domain=domain, bias=known_bias_label, text=text[:4000])
         
         try:
             response = self.model.generate_content(prompt)
             # Clean up potential markdown code blocks in response
             content = response.text.replace("```json", "").replace("```", "").strip()
-            data = json.loads(content)
+            data = orjson.loads(content)
             
             # Update the existing article object
             article.headline = data.get("headline", article.headline)
@@ -243,7 +231,7 @@ class AnalystAgent:
             article.bias_label = BiasLabel(data.get("bias_label", "Center"))
             # Merge tags
             new_tags = data.get("topic_tags", [])
-            article.topic_tags = list(set(article.topic_tags + new_tags))
+            article.topic_tags = list(dict.fromkeys(article.topic_tags + new_tags))
             article.keywords = data.get("keywords", [])
             article.processing_status = ProcessingStatus.PROCESSED
             
@@ -291,7 +279,7 @@ class LibrarianAgent:
             text = response.text.strip()
             if text.startswith("```json"):
                 text = text[7:-3]
-            return json.loads(text)
+            return orjson.loads(text)
         except Exception as e:
             print(f"Error translating query: {e}")
             return {"keywords": [natural_language_query]}
@@ -1,21 +1,27 @@
 import os
 import asyncio
-from fastapi import FastAPI, Query, BackgroundTasks
-from pydantic import BaseModel
+import hashlib
+import itertools
+import orjson
+from fastapi import FastAPI, Query, Request, Response
 from typing import List
-from .models import Article, SearchRequest, ProcessingStatus
+from cachetools import TTLCache
+from .models import Article, SearchRequest, ProcessingStatus, to_articles
 from .agents import HarvesterAgent, AnalystAgent, LibrarianAgent, NewsChiefAgent
-from .database import get_recent_articles, save_article, search_articles_by_query
+from .database import iter_recent_articles, save_articles_bulk, search_articles_by_query, cleanup_articles, warm_write_cache, get_recent_urls, backfill_article_dates, migrate_legacy_doc_ids
+from .tools import start_http_session, close_http_session, close_parse_pool, mark_seen, commit_feed_state
 from dotenv import load_dotenv
 
 load_dotenv()
 
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from fastapi.encoders import jsonable_encoder
 import pathlib
+from email.utils import formatdate
 
-app = FastAPI(title="AI News Aggregator")
+app = FastAPI(title="AI News Aggregator", default_response_class=ORJSONResponse)
 
 app.add_middleware(
     CORSMiddleware,
@@ -30,6 +36,32 @@ frontend_dist = pathlib.Path(__file__).parent.parent / "frontend" / "dist"
 if frontend_dist.exists():
     app.mount("/assets", StaticFiles(directory=str(frontend_dist / "assets")), name="assets")
 
+@app.middleware("http")
+async def cache_static_assets(request: Request, call_next):
+    response = await call_next(request)
+    # Built asset filenames are content-hashed, so they never change in place
+    if request.url.path.startswith("/assets/") and response.status_code == 200:
+        response.headers["Cache-Control"] = "public, max-age=31536000, immutable"
+    return response
+
+def _load_index_page():
+    """
+    Reads the built index.html once; it only changes on deploy.
+    Returns (body, headers) or None if the frontend isn't built.
+    """
+    index_file = frontend_dist / "index.html"
+    if not index_file.exists():
+        return None
+    body = index_file.read_bytes()
+    headers = {
+        "ETag": '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"',
+        "Last-Modified": formatdate(index_file.stat().st_mtime, usegmt=True),
+        "Cache-Control": "public, max-age=60",
+    }
+    return body, headers
+
+_index_page = _load_index_page()
+
 # Initialize Agents
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 FEEDS = {
@@ -51,122 +83,293 @@ FEEDS = {
     ]
 }
 
+# Short-lived response caches for the read endpoints; cleared whenever new
+# articles are written
+feed_cache = TTLCache(maxsize=64, ttl=30)
+dates_cache = TTLCache(maxsize=1, ttl=60)
+
+def invalidate_read_caches():
+    feed_cache.clear()
+    dates_cache.clear()
+
 # Instantiate ADK Agents
 harvester = HarvesterAgent(feeds=FEEDS)
 analyst = AnalystAgent() # API key is handled in agents.py via env or genai.configure
 librarian = LibrarianAgent()
 news_chief = NewsChiefAgent(harvester=harvester, analyst=analyst)
 
+# Background jobs (refresh, process-queue, backfill) run one at a time on a
+# single worker; a job that is already waiting in the queue isn't queued twice.
+# Lower priority runs first, so user-triggered refreshes go ahead of backfills.
+JOB_QUEUE_SIZE = 100
+JOB_PRIORITIES = {"refresh": 0, "process-queue": 1, "backfill": 2}
+_job_seq = itertools.count() # FIFO order within a priority
+_job_queue = None
+_queued_jobs = set()
+_job_worker = None
+
+async def _run_jobs():
+    while True:
+        _, _, job = await _job_queue.get()
+        _queued_jobs.discard(job)
+        try:
+            print(f"Job worker: starting '{job}'", flush=True)
+            await JOB_HANDLERS[job]()
+        except Exception as e:
+            print(f"Error in job '{job}': {e}", flush=True)
+        finally:
+            _job_queue.task_done()
+
+def enqueue_job(job: str) -> bool:
+    """
+    Queues a background job. Returns False if it is already queued (or the queue is full).
+    """
+    if job in _queued_jobs:
+        return False
+    try:
+        _job_queue.put_nowait((JOB_PRIORITIES[job], next(_job_seq), job))
+    except asyncio.QueueFull:
+        return False
+    _queued_jobs.add(job)
+    return True
+
+@app.on_event("startup")
+async def startup():
+    global _job_queue, _job_worker
+    # Open the shared scraping session (pooled keep-alive connections)
+    await start_http_session()
+    # Move articles still stored under legacy document IDs (runs once)
+    await migrate_legacy_doc_ids()
+    await warm_write_cache()
+    # Record dates of articles stored before dates were materialized (runs once)
+    await backfill_article_dates()
+    # Skip re-harvesting articles ingested before this process started
+    mark_seen(await get_recent_urls())
+    _job_queue = asyncio.PriorityQueue(maxsize=JOB_QUEUE_SIZE)
+    _job_worker = asyncio.create_task(_run_jobs())
+
+@app.on_event("shutdown")
+async def shutdown():
+    # Don't hold shutdown for a long-running job; unsaved work is retried later
+    if _job_worker:
+        _job_worker.cancel()
+    await close_http_session()
+    close_parse_pool()
+
 @app.post("/api/batch-ingest")
-async def batch_ingest(background_tasks: BackgroundTasks):
+async def batch_ingest():
     """
     Triggers the News Chief to refresh the news (harvest + analyze).
     Runs in background.
     """
-    background_tasks.add_task(run_news_refresh)
+    if not enqueue_job("refresh"):
+        return {"status": "already_queued", "message": "A News Chief refresh is already queued."}
     return {"status": "started", "message": "News Chief started refresh cycle in background."}
 
+# Analyzed articles are buffered and written in batches
+SAVE_BATCH_SIZE = 25
+SAVE_FLUSH_INTERVAL = 0.5 # seconds the bulk saver waits for more articles before flushing
+
 async def run_news_refresh():
     """
     Background task wrapper for News Chief.
     """
     print("Background: Triggering News Chief...", flush=True)
     try:
-        result = await news_chief.refresh_news()
+        # A saver task commits analyzed articles in batches while the rest are
+        # still being processed. Failed articles are saved too so the
+        # process-queue endpoint can retry them.
+        save_q = asyncio.Queue()
+        saver = asyncio.create_task(_bulk_saver(save_q))
+        processed_count = failed_count = 0
+        try:
+            async for article in news_chief.stream():
+                if article.processing_status == ProcessingStatus.PROCESSED:
+                    processed_count += 1
+                else:
+                    failed_count += 1
+                await save_q.put(article)
+        finally:
+            await save_q.put(None)
+            unsaved = await saver
+        print(f"News Chief finished. Success: {processed_count}, Failed: {failed_count}", flush=True)
         
-        # Save results to DB
-        # The refresh_news returns processed articles, we should save them.
-        # Note: Harvester creates PENDING articles, Analyst updates them.
-        # We need to ensure they are saved.
-        # In the new flow, NewsChief returns the list of articles.
+        # Feeds answer 304 once their validators are kept, so only keep them
+        # when every harvested article made it to Firestore
+        if unsaved:
+            print(f"{unsaved} articles were not saved; feeds will be re-fetched next refresh.", flush=True)
+        else:
+            commit_feed_state()
         
-        print(f"News Chief finished. Saving {len(result['articles'])} articles...", flush=True)
-        for article in result['articles']:
-            await save_article(article)
+        # Trigger cleanup to enforce retention policies (after the new articles are in)
+        await cleanup_articles()
+        invalidate_read_caches()
             
         print("News Chief cycle complete.", flush=True)
     except Exception as e:
         print(f"Error in News Chief cycle: {e}", flush=True)
 
 @app.post("/api/process-queue")
-async def process_queue(background_tasks: BackgroundTasks):
+async def process_queue():
     """
     Legacy endpoint: Manually triggers processing of pending articles.
     We can map this to the Analyst directly or just ignore if Chief handles everything.
     For compatibility, let's implement a queue processor using the Analyst.
     """
-    background_tasks.add_task(process_background_queue)
+    if not enqueue_job("process-queue"):
+        return {"status": "already_queued", "message": "Queue processing is already queued."}
     return {"status": "processing_started", "message": "Background processing triggered."}
 
 @app.post("/api/process-backfill")
-async def process_backfill(background_tasks: BackgroundTasks):
+async def process_backfill():
     """
     Triggers a backfill process for older articles.
     """
-    background_tasks.add_task(process_backfill_queue)
+    if not enqueue_job("backfill"):
+        return {"status": "already_queued", "message": "Backfill is already queued."}
     return {"status": "backfill_started", "message": "Backfill processing triggered."}
 
+async def _bulk_saver(save_q: asyncio.Queue) -> int:
+    """
+    Drains `save_q` into batched Firestore writes until a None sentinel arrives.
+    Returns the number of articles that failed to save.
+    """
+    unsaved = 0
+    done = False
+    while not done:
+        item = await save_q.get()
+        if item is None:
+            break
+        batch = [item]
+        while len(batch) < SAVE_BATCH_SIZE:
+            try:
+                item = await asyncio.wait_for(save_q.get(), timeout=SAVE_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+            
+        try:
+            await save_articles_bulk(batch)
+            mark_seen(a.url for a in batch)
+        except Exception as e:
+            print(f"Error saving {len(batch)} articles: {e}", flush=True)
+            unsaved += len(batch)
+    return unsaved
+
+BACKFILL_CONCURRENCY = 3
+
 async def process_backfill_queue():
     print("Starting backfill processing...", flush=True)
-    from .database import get_backfill_candidates, save_article
+    from .database import get_backfill_candidates
     
     articles_data = await get_backfill_candidates(limit=20)
     print(f"Found {len(articles_data)} articles needing backfill.", flush=True)
     
-    for article_data in articles_data:
-        try:
-            article = Article(**article_data)
-            if article.processing_status != ProcessingStatus.PENDING:
-                article.processing_status = ProcessingStatus.PENDING
-            
+    save_q = asyncio.Queue()
+    saver = asyncio.create_task(_bulk_saver(save_q))
+    sem = asyncio.Semaphore(BACKFILL_CONCURRENCY)
+    
+    async def backfill_one(article: Article):
+        async with sem:
             print(f"Backfilling article: {article.headline}", flush=True)
             try:
                 processed_article = await asyncio.wait_for(
                     analyst.process_article(article),
                     timeout=30.0
                 )
-                await save_article(processed_article)
+                await save_q.put(processed_article)
             except Exception as e:
                 print(f"Error backfilling article {article.url}: {e}", flush=True)
                 article.processing_status = ProcessingStatus.FAILED
-                await save_article(article)
+                await save_q.put(article)
             
-            await asyncio.sleep(2)
-        except Exception as e:
-            print(f"Error preparing article for backfill: {e}", flush=True)
+    # Re-queue on the raw records, so each article is validated exactly once
+    for data in articles_data:
+        data["processing_status"] = ProcessingStatus.PENDING.value
+    await asyncio.gather(*(backfill_one(article) for article in to_articles(articles_data)))
+            
+    await save_q.put(None)
+    await saver
+    invalidate_read_caches()
+
+# Bounds for a single /api/process-queue run
+QUEUE_BATCH_SIZE = 10 # Firestore page size
+QUEUE_MAX_BATCHES = 20
+QUEUE_WORKERS = 3
+QUEUE_TIME_BUDGET = 600 # seconds
 
 async def process_background_queue():
     print("Starting background processing queue...", flush=True)
     from .database import get_pending_articles
     
-    pending_articles_data = await get_pending_articles(limit=10, statuses=["pending", "failed"])
-    if not pending_articles_data:
-        return
-
-    pending_articles = [Article(**data) for data in pending_articles_data]
+    queue = asyncio.Queue(maxsize=QUEUE_BATCH_SIZE * 2)
+    save_q = asyncio.Queue()
+    saver = asyncio.create_task(_bulk_saver(save_q))
     
-    sem = asyncio.Semaphore(3)
-
-    async def process_single(article: Article):
-        async with sem:
+    async def producer():
+        # Keeps the queue topped up page by page (cursor-paginated)
+        last_doc = None
+        try:
+            for _ in range(QUEUE_MAX_BATCHES):
+                pending_docs, last_doc = await get_pending_articles(
+                    limit=QUEUE_BATCH_SIZE, statuses=["pending", "failed"], start_after=last_doc
+                )
+                for article in to_articles([doc.to_dict() for doc in pending_docs]):
+                    await queue.put(article)
+                if len(pending_docs) < QUEUE_BATCH_SIZE:
+                    break
+        except Exception as e:
+            print(f"Error fetching pending articles: {e}", flush=True)
+        # Not sent on cancellation (time budget exhausted): the workers are
+        # cancelled too, so a put on a full queue would block forever
+        for _ in range(QUEUE_WORKERS):
+            await queue.put(None)
+    
+    async def worker():
+        while (article := await queue.get()) is not None:
             try:
                 print(f"Processing: {article.headline[:30]}...", flush=True)
                 updated_article = await asyncio.wait_for(analyst.process_article(article), timeout=45.0)
                 if updated_article:
-                    await save_article(updated_article)
-                    return 1
+                    await save_q.put(updated_article)
             except Exception as e:
                 print(f"Error processing article {article.url}: {e}", flush=True)
                 article.processing_status = ProcessingStatus.FAILED
-                await save_article(article)
-            return 0
-
-    tasks = [process_single(article) for article in pending_articles]
-    await asyncio.gather(*tasks)
+                await save_q.put(article)
+    
+    try:
+        await asyncio.wait_for(
+            asyncio.gather(producer(), *(worker() for _ in range(QUEUE_WORKERS))),
+            timeout=QUEUE_TIME_BUDGET
+        )
+    except asyncio.TimeoutError:
+        print("Queue processing stopped: time budget exhausted.", flush=True)
+    # Flush whatever is still buffered
+    await save_q.put(None)
+    await saver
+    invalidate_read_caches()
     print("Queue processing complete.", flush=True)
 
+JOB_HANDLERS = {
+    "refresh": run_news_refresh,
+    "process-queue": process_background_queue,
+    "backfill": process_backfill_queue,
+}
+
+def _cached_response(request: Request, body: bytes, etag: str) -> Response:
+    # Clients revalidating with a matching ETag get an empty 304
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(body, media_type="application/json", headers={"ETag": etag})
+
+def _etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=8).hexdigest() + '"'
+
 @app.get("/api/feed")
-async def get_feed(date: str = None):
+async def get_feed(request: Request, date: str = None):
     filter_date = None
     if date:
         try:
@@ -174,12 +377,38 @@ async def get_feed(date: str = None):
             filter_date = datetime.strptime(date, "%Y-%m-%d").date()
         except ValueError:
             pass
-    return await get_recent_articles(filter_date=filter_date)
+            
+    key = filter_date.isoformat() if filter_date else "latest"
+    if key in feed_cache:
+        return _cached_response(request, *feed_cache[key])
+    # Stream the JSON array as documents arrive instead of materializing the
+    # whole list first; the cache is filled once the stream completes
+    return StreamingResponse(_stream_feed(key, filter_date), media_type="application/json")
+
+async def _stream_feed(key: str, filter_date):
+    chunks = [b"["]
+    yield b"["
+    try:
+        async for data in iter_recent_articles(filter_date=filter_date):
+            # jsonable_encoder first: Firestore timestamps are datetime subclasses orjson rejects
+            chunk = (b"," if len(chunks) > 1 else b"") + orjson.dumps(jsonable_encoder(data))
+            chunks.append(chunk)
+            yield chunk
+        chunks.append(b"]")
+        body = b"".join(chunks)
+        feed_cache[key] = (body, _etag(body))
+    except Exception as e:
+        # Headers are already sent; close the array with what we have
+        print(f"Error streaming feed: {e}", flush=True)
+    yield b"]"
 
 @app.get("/api/available-dates")
-async def get_available_dates():
+async def get_available_dates(request: Request):
     from .database import get_available_dates as db_get_dates
-    return await db_get_dates()
+    if "dates" not in dates_cache:
+        body = orjson.dumps(await db_get_dates())
+        dates_cache["dates"] = (body, _etag(body))
+    return _cached_response(request, *dates_cache["dates"])
 
 @app.post("/api/search")
 async def search_articles(request: SearchRequest):
@@ -199,14 +428,16 @@ async def get_similar_articles(url: str):
     return results
 
 @app.get("/{full_path:path}")
-async def serve_frontend(full_path: str):
+async def serve_frontend(request: Request, full_path: str):
     if full_path.startswith("api/"):
         return {"detail": "Not Found"}
     
-    index_file = frontend_dist / "index.html"
-    if index_file.exists():
-        return FileResponse(str(index_file))
-    return {"detail": "Frontend not built"}
+    if _index_page is None:
+        return {"detail": "Frontend not built"}
+    body, headers = _index_page
+    if request.headers.get("if-none-match") == headers["ETag"]:
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="text/html", headers=headers)
 
 if __name__ == "__main__":
     import uvicorn
@@ -1,4 +1,4 @@
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
 from typing import List, Optional
 from datetime import datetime
 from enum import Enum
@@ -29,5 +29,24 @@ class Article(BaseModel):
     created_at: datetime = Field(default_factory=datetime.utcnow)
     expire_at: datetime
 
+# Validates a whole page of records in one call
+ARTICLE_LIST = TypeAdapter(List[Article])
+
+def to_articles(records: List[dict]) -> List[Article]:
+    """
+    Validates stored article records into Articles.
+    """
+    try:
+        return ARTICLE_LIST.validate_python(records)
+    except ValidationError:
+        # Fall back to per-record validation so one bad document doesn't drop the page
+        articles = []
+        for data in records:
+            try:
+                articles.append(Article(**data))
+            except Exception as e:
+                print(f"Error preparing article {data.get('url')}: {e}", flush=True)
+        return articles
+
 class SearchRequest(BaseModel):
     query: str
@@ -1,106 +1,297 @@
 import feedparser
-import requests
-from bs4 import BeautifulSoup
+from cachetools import TTLCache
+import aiohttp
+from lxml import etree, html as lxml_html
 from datetime import datetime, timedelta
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+import re
 import ssl
 import asyncio
+import os
+import multiprocessing
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
 
-# Bypass SSL verification for local dev issues
-if hasattr(ssl, '_create_unverified_context'):
-    ssl._create_default_https_context = ssl._create_unverified_context
+# One TLS context shared by every pooled connection (enables session resumption)
+SSL_CTX = ssl.create_default_context()
 
-def fetch_rss_articles(feeds: Dict[str, List[str]]) -> List[Dict[str, Any]]:
+USER_AGENT = "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"
+
+# Shared HTTP session so article scrapes reuse pooled keep-alive connections
+_http_session: Optional[aiohttp.ClientSession] = None
+
+def get_http_session() -> aiohttp.ClientSession:
+    """
+    Returns the shared aiohttp session, creating it on first use.
+    Must be called from within a running event loop.
+    """
+    global _http_session
+    if _http_session is None or _http_session.closed:
+        connector = aiohttp.TCPConnector(
+            ssl=SSL_CTX,
+            limit=100,
+            limit_per_host=4,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+            enable_cleanup_closed=True
+        )
+        _http_session = aiohttp.ClientSession(
+            connector=connector,
+            headers={"User-Agent": USER_AGENT},
+            # Per-socket limits rather than `total`, which would also count the
+            # time scrapes spend queued for one of the limit_per_host connections
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=5, sock_read=5)
+        )
+    return _http_session
+
+async def start_http_session():
+    get_http_session()
+
+async def close_http_session():
+    global _http_session
+    if _http_session is not None and not _http_session.closed:
+        await _http_session.close()
+    _http_session = None
+
+# Max number of feeds fetched at the same time
+FEED_FETCH_CONCURRENCY = 16
+
+# Per-feed (etag, modified) validators from the last successful refresh,
+# sent back as If-None-Match / If-Modified-Since on the next one
+_feed_state: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+# Validators from the latest fetch; only kept (commit_feed_state) once its
+# articles are saved, so a failed refresh re-downloads the feeds next time
+_pending_feed_state: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+
+def commit_feed_state():
+    _feed_state.update(_pending_feed_state)
+    _pending_feed_state.clear()
+
+FEED_FETCH_TIMEOUT = 10
+# Feeds at least this large are parsed in the process pool; smaller ones
+# are not worth the IPC cost and are parsed in a thread instead
+PROCESS_PARSE_MIN_BYTES = 256 * 1024
+
+_parse_pool: Optional[ProcessPoolExecutor] = None
+
+def _get_parse_pool() -> ProcessPoolExecutor:
+    global _parse_pool
+    if _parse_pool is None:
+        # spawn rather than fork: the parent holds gRPC/event-loop threads
+        _parse_pool = ProcessPoolExecutor(
+            max_workers=min(4, os.cpu_count() or 1),
+            mp_context=multiprocessing.get_context("spawn")
+        )
+    return _parse_pool
+
+def close_parse_pool():
+    global _parse_pool
+    if _parse_pool is not None:
+        _parse_pool.shutdown(wait=False, cancel_futures=True)
+    _parse_pool = None
+
+def _parse_feed_entries(body: bytes) -> List[Dict[str, Any]]:
+    """
+    Parses raw feed XML and returns the entry fields the harvester needs
+    as plain dicts (cheap to send back from a worker process).
+    """
+    feed = feedparser.parse(body)
+    entries = []
+    for entry in feed.entries:
+        published_parsed = entry.get("published_parsed") or entry.get("updated_parsed")
+        entries.append({
+            "link": entry.get("link", ""),
+            "title": entry.get("title", ""),
+            "summary": entry.get("summary") or entry.get("description"),
+            # (Y, M, D, h, m, s) in UTC; compares chronologically as a tuple
+            "published_parsed": tuple(published_parsed[:6]) if published_parsed else None
+        })
+    # Newest first (undated entries last), so the harvester can stop at the first stale entry
+    entries.sort(key=lambda e: e["published_parsed"] or (0,), reverse=True)
+    return entries
+
+# Query parameters that only track the referrer and never change the page
+TRACKING_PARAMS = {"fbclid", "gclid", "mc_cid", "mc_eid", "ocid", "cmpid", "ref", "smid"}
+
+def canonicalize_url(url: str) -> str:
+    """
+    Normalizes an article URL for de-duplication: lowercases scheme and host,
+    drops the fragment, utm_* and other tracking params, and any trailing slash.
+    """
+    parts = urlsplit(url.strip())
+    query = [
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith("utm_") and key.lower() not in TRACKING_PARAMS
+    ]
+    path = parts.path.rstrip("/") or "/"
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, urlencode(query), ""))
+
+# Canonical URLs of articles already ingested in the last 48 hours; harvests
+# skip them. Filled via mark_seen() after saves and at startup.
+SEEN = TTLCache(maxsize=10_000, ttl=48 * 3600)
+
+def mark_seen(urls):
+    for url in urls:
+        SEEN[canonicalize_url(url)] = True
+
+def flatten_feeds(feeds: Dict[str, List[str]]) -> Tuple[Tuple[str, str], ...]:
+    """
+    Flattens {category: [feed urls]} into (category, feed url) pairs.
+    """
+    return tuple((category, feed_url) for category, urls in feeds.items() for feed_url in urls)
+
+async def fetch_rss_articles(feeds: Dict[str, List[str]],
+                             jobs: Optional[Tuple[Tuple[str, str], ...]] = None) -> List[Dict[str, Any]]:
     """
     Fetches articles from the provided RSS feeds.
+    All feeds are fetched concurrently, then the per-category cap is applied.
+    Callers polling the same feeds repeatedly can pass the precomputed
+    flatten_feeds() result as `jobs`.
     Returns a list of article dictionaries.
     """
     articles = []
     cutoff_time = datetime.utcnow() - timedelta(hours=48)
+    cutoff_tuple = cutoff_time.utctimetuple()[:6]
     MAX_PER_CATEGORY = 12
     
     print(f"Fetching articles published after: {cutoff_time}", flush=True)
     
-    for category, urls in feeds.items():
-        print(f"--- Fetching Category: {category} ---", flush=True)
-        category_count = 0
-        
-        for feed_url in urls:
-            if category_count >= MAX_PER_CATEGORY:
-                break
-                
-            try:
-                print(f"Checking feed: {feed_url}", flush=True)
-                # feedparser is blocking, but we are wrapping this in a function 
-                # that can be called by an agent (potentially in a thread)
-                feed = feedparser.parse(feed_url)
-                
-                for entry in feed.entries:
-                    if category_count >= MAX_PER_CATEGORY:
-                        break
-
-                    # Parse date
-                    published_parsed = entry.get("published_parsed") or entry.get("updated_parsed")
-                    if not published_parsed:
-                        continue
-                        
-                    # Convert struct_time to datetime
-                    published_dt = datetime(*published_parsed[:6])
+    loop = asyncio.get_running_loop()
+    sem = asyncio.Semaphore(FEED_FETCH_CONCURRENCY)
+    if jobs is None:
+        jobs = flatten_feeds(feeds)
+
+    session = get_http_session()
+    # Validators left over from a refresh that failed are dropped
+    _pending_feed_state.clear()
+
+    async def fetch_one(feed_url: str) -> Optional[List[Dict[str, Any]]]:
+        """
+        Downloads one feed and returns its parsed entries, or None if unchanged.
+        """
+        async with sem:
+            print(f"Checking feed: {feed_url}", flush=True)
+            etag, modified = _feed_state.get(feed_url, (None, None))
+            headers = {}
+            if etag:
+                headers["If-None-Match"] = etag
+            if modified:
+                headers["If-Modified-Since"] = modified
+            async with session.get(feed_url, headers=headers, timeout=aiohttp.ClientTimeout(total=FEED_FETCH_TIMEOUT)) as resp:
+                if resp.status == 304:
+                    return None
+                resp.raise_for_status()
+                body = await resp.read()
+                etag, modified = resp.headers.get("ETag"), resp.headers.get("Last-Modified")
+            
+        # XML parsing is CPU-bound: large feeds go to the process pool, the rest to a thread
+        executor = _get_parse_pool() if len(body) >= PROCESS_PARSE_MIN_BYTES else None
+        entries = await loop.run_in_executor(executor, _parse_feed_entries, body)
+        if etag or modified:
+            _pending_feed_state[feed_url] = (etag, modified)
+        return entries
+
+    results = await asyncio.gather(*[fetch_one(feed_url) for _, feed_url in jobs], return_exceptions=True)
+    
+    category_counts = Counter()
+    # canonical URL -> article dict, so a story cross-posted in several
+    # categories is analyzed once and tagged with all of them
+    seen: Dict[str, Dict[str, Any]] = {}
+    for (category, feed_url), entries in zip(jobs, results):
+        if isinstance(entries, Exception):
+            print(f"Error fetching feed {feed_url}: {entries}", flush=True)
+            continue
+        if entries is None:
+            print(f"Feed not modified since last refresh: {feed_url}", flush=True)
+            continue
+            
+        if category_counts[category] >= MAX_PER_CATEGORY:
+            continue
+            
+        try:
+            # Entries are sorted newest first, so the first undated or stale
+            # entry ends the feed
+            for entry in entries:
+                published_parsed = entry["published_parsed"]
+                if not published_parsed:
+                    break
                     
-                    # Filter for last 48 hours
-                    if published_dt >= cutoff_time:
-                        article_data = {
-                            "url": entry.get("link", ""),
-                            "headline": entry.get("title", ""),
-                            "summary": entry.get("summary") or entry.get("description") or "Summary unavailable",
-                            "topic_tags": [category],
-                            "created_at": published_dt.isoformat()
-                        }
-                        
-                        if article_data["url"] and article_data["headline"]:
-                            articles.append(article_data)
-                            category_count += 1
-            except Exception as e:
-                print(f"Error fetching feed {feed_url}: {e}", flush=True)
-        
-        print(f"Fetched {category_count} articles for {category}", flush=True)
+                # Filter for last 48 hours on the time tuple, so stale entries
+                # never allocate a datetime
+                if published_parsed < cutoff_tuple:
+                    break
+                    
+                if not entry["link"] or not entry["title"]:
+                    continue
+                    
+                canonical_url = canonicalize_url(entry["link"])
+                if canonical_url in SEEN:
+                    # Already ingested by an earlier refresh
+                    continue
+                if canonical_url in seen:
+                    existing = seen[canonical_url]
+                    existing["topic_tags"] = list(dict.fromkeys(existing["topic_tags"] + [category]))
+                    continue
+                    
+                published_dt = datetime(*published_parsed)
+                article_data = {
+                    "url": entry["link"],
+                    "headline": entry["title"],
+                    "summary": entry["summary"] or "Summary unavailable",
+                    "topic_tags": [category],
+                    "created_at": published_dt.isoformat()
+                }
+                articles.append(article_data)
+                seen[canonical_url] = article_data
+                category_counts[category] += 1
+                if category_counts[category] >= MAX_PER_CATEGORY:
+                    break
+        except Exception as e:
+            print(f"Error parsing feed {feed_url}: {e}", flush=True)
+    
+    for category in feeds:
+        print(f"Fetched {category_counts[category]} articles for {category}", flush=True)
             
     print(f"Found {len(articles)} articles in total.", flush=True)
     return articles
 
-def scrape_article_content(url: str, fallback_summary: str = "") -> str:
+# Phrases common in paywall / anti-bot pages, matched in a single case-insensitive pass
+BLOCKING_PHRASES = [
+    "enable javascript", "disable ad blocker", "turn off your ad blocker",
+    "subscribe to read", "subscription required", "sign in to continue",
+    "you have reached your limit", "access to this content is restricted",
+    "please enable cookies"
+]
+_BLOCK_RE = re.compile("|".join(map(re.escape, BLOCKING_PHRASES)), re.IGNORECASE)
+
+def _extract_paragraphs(body: bytes) -> str:
     """
-    Fetches the full text content of an article URL.
+    Parses raw HTML and returns the joined paragraph text (max 5000 chars).
+    CPU-bound, so callers run it in a worker thread.
     """
-    BLOCKING_PHRASES = [
-        "enable javascript", "disable ad blocker", "turn off your ad blocker",
-        "subscribe to read", "subscription required", "sign in to continue",
-        "you have reached your limit", "access to this content is restricted",
-        "please enable cookies"
-    ]
+    tree = lxml_html.fromstring(body)
+    
+    # Remove script and style elements
+    etree.strip_elements(tree, "script", "style", "nav", "footer", "header", with_tail=False)
+        
+    content = " ".join([p.text_content() for p in tree.iter("p")])
+    return content[:5000] # Limit to 5000 chars
 
+async def scrape_article_content(url: str, fallback_summary: str = "") -> str:
+    """
+    Fetches the full text content of an article URL.
+    """
     try:
-        resp = requests.get(url, timeout=5, headers={"User-Agent": "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.114 Safari/537.36"})
-        soup = BeautifulSoup(resp.content, 'html.parser')
+        session = get_http_session()
+        async with session.get(url) as resp:
+            body = await resp.read()
         
-        # Remove script and style elements
-        for script in soup(["script", "style", "nav", "footer", "header"]):
-            script.decompose()
-            
-        paragraphs = soup.find_all('p')
-        content = " ".join([p.get_text() for p in paragraphs])
-        text = content[:5000] # Limit to 5000 chars
+        # Parse off the event loop so other scrapes keep making progress
+        text = await asyncio.to_thread(_extract_paragraphs, body)
         
         # Check for blocking content
-        text_lower = text.lower()
-        is_blocked = False
-        if len(text) < 200:
-            is_blocked = True
-        else:
-            for phrase in BLOCKING_PHRASES:
-                if phrase in text_lower:
-                    is_blocked = True
-                    break
+        is_blocked = len(text) < 200 or bool(_BLOCK_RE.search(text))
         
         if is_blocked:
             print(f"Content blocked or too short for {url}. Using fallback.")
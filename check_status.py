@@ -1,45 +1,33 @@
 import asyncio
-import os
-from google.cloud import firestore
+from google.cloud.firestore_v1.base_query import FieldFilter
+from backend.database import get_firestore_client, COLLECTION_NAME
 from backend.models import ProcessingStatus
 
-# Initialize Firestore
-db = firestore.Client()
-COLLECTION_NAME = "articles"
+async def count(query) -> int:
+    # Server-side aggregation: no documents are transferred
+    result = await query.count().get()
+    return result[0][0].value
 
 async def check_status():
     print("Checking article status...")
-    docs = db.collection(COLLECTION_NAME).stream()
+    db = get_firestore_client()
+    if not db:
+        print("! Firestore Client NOT initialized.")
+        return
+    articles = db.collection(COLLECTION_NAME)
     
-    total = 0
-    pending = 0
-    processed = 0
-    failed = 0
-    with_keywords = 0
-    without_keywords = 0
-    
-    for doc in docs:
-        total += 1
-        data = doc.to_dict()
-        status = data.get("processing_status")
-        keywords = data.get("keywords", [])
-        
-        if status == "pending":
-            pending += 1
-        elif status == "processed":
-            processed += 1
-        elif status == "failed":
-            failed += 1
-            
-        if keywords:
-            with_keywords += 1
-        else:
-            without_keywords += 1
+    total = await count(articles)
+    by_status = {
+        status: await count(articles.where(filter=FieldFilter("processing_status", "==", status.value)))
+        for status in ProcessingStatus
+    }
+    with_keywords = await count(articles.where(filter=FieldFilter("keywords", "!=", [])))
+    without_keywords = total - with_keywords
             
     print(f"Total Articles: {total}")
-    print(f"Pending: {pending}")
-    print(f"Processed: {processed}")
-    print(f"Failed: {failed}")
+    print(f"Pending: {by_status[ProcessingStatus.PENDING]}")
+    print(f"Processed: {by_status[ProcessingStatus.PROCESSED]}")
+    print(f"Failed: {by_status[ProcessingStatus.FAILED]}")
     print(f"With Keywords: {with_keywords}")
     print(f"Without Keywords: {without_keywords}")
 
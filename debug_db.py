@@ -1,8 +1,9 @@
 import asyncio
-from backend.database import get_recent_articles, db, COLLECTION_NAME
+from backend.database import get_recent_articles, get_firestore_client, COLLECTION_NAME
 
 async def check_db():
     print(f"Checking Firestore Collection: {COLLECTION_NAME}")
+    db = get_firestore_client()
     if not db:
         print("! Firestore Client NOT initialized.")
         return
@@ -10,7 +11,7 @@ async def check_db():
     # Check count (approx)
     docs = db.collection(COLLECTION_NAME).limit(5).stream()
     count = 0
-    for doc in docs:
+    async for doc in docs:
         count += 1
         print(f"Found Doc ID: {doc.id}")
         data = doc.to_dict()
@@ -1,59 +1,154 @@
 import asyncio
+import logging
+import logging.handlers
 import os
+import queue
 from dotenv import load_dotenv
-from backend.agents import AnalystAgent
-from backend.models import Article, BiasLabel, ProcessingStatus
-from backend.database import save_article, get_backfill_candidates
-from datetime import datetime, timedelta
 
-# Load environment variables
+# Load environment variables once at import, before backend.agents reads the API key
 load_dotenv("backend/.env")
+API_KEY = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
+
+from backend.agents import AnalystAgent, ANALYSIS_BATCH_SIZE
+from backend.models import ProcessingStatus, to_articles
+from backend.database import save_articles_bulk, iter_pending_pages
+from backend.tools import close_http_session, close_parse_pool
+
+log = logging.getLogger("test_processing")
+
+# Batched Gemini requests in flight at once
+CONCURRENCY = 4
+# Batches of candidates to process per run
+MAX_BATCHES = 8
+# Batches fetched ahead of the processors
+PREFETCH_BATCHES = 2
+# Firestore page size for the candidate stream
+STREAM_PAGE_SIZE = 64
 
 async def test_processing():
-    print("Testing article processing...")
+    log.info("Testing article processing...")
     
-    # Get API key
-    api_key = os.getenv("GOOGLE_API_KEY") or os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("ERROR: No API key found!")
+    if not API_KEY:
+        log.error("ERROR: No API key found!")
         return
     
-    print(f"API Key found: {api_key[:10]}...")
+    log.info(f"API Key found: {API_KEY[:10]}...")
     
-    # Initialize agent
-    analyst = AnalystAgent(api_key)
-    print(f"Analyst initialized with model: {analyst.model}")
+    # Initialize agent (reads the API key from the environment)
+    analyst = AnalystAgent()
+    log.info(f"Analyst initialized with model: {analyst.model}")
     
-    # Get one candidate
-    candidates = await get_backfill_candidates(limit=1)
-    if not candidates:
-        print("No candidates found!")
-        return
-        
-    print(f"Found candidate: {candidates[0].get('headline')}")
+    # Three-stage pipeline: fetching the next page from Firestore overlaps with
+    # Gemini processing of the current batches and saving of finished ones.
+    # Bounded, so the prefetcher runs at most PREFETCH_BATCHES ahead
+    fetch_q = asyncio.Queue(maxsize=PREFETCH_BATCHES)
+    save_q = asyncio.Queue(maxsize=2)
+    
+    async def prefetcher():
+        batch = []
+        batches = 0
+        try:
+            # Rows stream in page by page; each page is validated in one call
+            # and grouped into analysis batches
+            async for page in iter_pending_pages(statuses=["pending", "failed"], page_size=STREAM_PAGE_SIZE):
+                for article in to_articles(page):
+                    log.info(f"- {article.headline} (status: {article.processing_status}, keywords: {article.keywords})")
+                    batch.append(article)
+                    if len(batch) == ANALYSIS_BATCH_SIZE:
+                        await fetch_q.put(batch)
+                        batch = []
+                        batches += 1
+                        if batches == MAX_BATCHES:
+                            break
+                if batches == MAX_BATCHES:
+                    break
+            if batch:
+                await fetch_q.put(batch)
+        except Exception as e:
+            log.error(f"ERROR fetching candidates: {e}")
+        # Not sent on cancellation: the processors are cancelled too, so a put
+        # on the full queue would block forever
+        for _ in range(CONCURRENCY):
+            await fetch_q.put(None)
+    
+    # Articles whose batch failed; retried one by one after the pipeline
+    dead_letter = []
     
-    # Convert to Article
-    article = Article(**candidates[0])
-    print(f"Article status before: {article.processing_status}")
-    print(f"Article keywords before: {article.keywords}")
+    async def processor():
+        # Up to CONCURRENCY batched Gemini requests in flight
+        while (batch := await fetch_q.get()) is not None:
+            try:
+                processed = await analyst.process_articles(batch)
+            except Exception as e:
+                log.error(f"ERROR processing batch of {len(batch)}: {e}")
+                dead_letter.extend(batch)
+                continue
+            dead_letter.extend(a for a in processed if a.processing_status == ProcessingStatus.FAILED)
+            await save_q.put([a for a in processed if a.processing_status != ProcessingStatus.FAILED])
+    
+    async def saver():
+        while (processed := await save_q.get()) is not None:
+            if not processed:
+                continue
+            for article in processed:
+                log.info(f"- {article.headline}")
+                log.info(f"  status: {article.processing_status}, bias: {article.bias_label}, keywords: {article.keywords}")
+            # One batched write per processed batch
+            await save_articles_bulk(processed)
+            log.info(f"Saved {len(processed)} articles.")
+    
+    async def retry_dead_letter():
+        if not dead_letter:
+            return
+        log.info(f"Retrying {len(dead_letter)} failed articles individually...")
+        results = await asyncio.gather(*(analyst.process_article(a) for a in dead_letter), return_exceptions=True)
+        for article, result in zip(dead_letter, results):
+            if isinstance(result, Exception):
+                log.error(f"ERROR retrying {article.url}: {result}")
+                article.processing_status = ProcessingStatus.FAILED
+            log.info(f"- {article.headline} (status: {article.processing_status})")
+        # Saved either way, so still-failed articles keep their FAILED status
+        await save_articles_bulk(dead_letter)
+        log.info(f"Saved {len(dead_letter)} retried articles.")
+    
+    async def processors():
+        await asyncio.gather(*(processor() for _ in range(CONCURRENCY)))
+        await save_q.put(None)
     
-    # Process it
     try:
-        print("Processing article...")
-        processed = await analyst.process_article(article)
-        print(f"Article status after: {processed.processing_status}")
-        print(f"Article keywords after: {processed.keywords}")
-        print(f"Article bias: {processed.bias_label}")
+        log.info("Processing articles...")
+        stages = [asyncio.ensure_future(stage) for stage in (prefetcher(), processors(), saver())]
+        try:
+            await asyncio.gather(*stages)
+        finally:
+            # A failed stage stops the rest, which would otherwise block on its queue
+            for stage in stages:
+                stage.cancel()
+            await asyncio.gather(*stages, return_exceptions=True)
+        await retry_dead_letter()
+        log.info("Articles saved successfully!")
         
-        # Save it
-        print("Saving article...")
-        await save_article(processed)
-        print("Article saved successfully!")
-        
-    except Exception as e:
-        print(f"ERROR during processing: {e}")
-        import traceback
-        traceback.print_exc()
+    except Exception:
+        log.exception("processing failed")
+    finally:
+        # The scraper opens the shared session lazily; close it with the loop still running
+        await close_http_session()
+        close_parse_pool()
 
 if __name__ == "__main__":
-    asyncio.run(test_processing())
+    # Use uvloop's faster event loop when it's installed
+    try:
+        import uvloop
+        uvloop.install()
+    except ImportError:
+        pass
+    # Log records go through a queue; a listener thread does the blocking
+    # stream writes, so logging never stalls the event loop
+    log_queue = queue.Queue()
+    logging.basicConfig(level=logging.INFO, format="%(message)s", handlers=[logging.handlers.QueueHandler(log_queue)])
+    listener = logging.handlers.QueueListener(log_queue, logging.StreamHandler())
+    listener.start()
+    try:
+        asyncio.run(test_processing())
+    finally:
+        listener.stop()